@@ -1,26 +1,45 @@
 #!/usr/bin/env python3
 """
 HTTP/HTTPS Proxy Checker Pro - проверка прокси серверов
-Многоуровневая проверка: TCP → HTTP Connect → IP → Download → Latency
+Многоуровневая проверка: HTTP/HTTPS + Latency → IP → Download
 """
 
 import os
+import sys
 import base64
 import asyncio
-import json
 import time
 import re
-from urllib.parse import urlparse
 from typing import Optional, Tuple
 from dataclasses import dataclass
+from collections import defaultdict
 import aiohttp
+import yarl
+import httpx
+import orjson
+
+try:
+    import uvloop  # Быстрый event loop (нет на Windows)
+except ImportError:
+    uvloop = None
 
 # ============== НАСТРОЙКИ ==============
-TIMEOUT_TCP = 5          # Таймаут TCP пинга
+TIMEOUT_TCP = 5          # Таймаут TCP соединения с прокси
 TIMEOUT_PROXY = 15       # Таймаут проверки через прокси
-MAX_CONCURRENT = 100     # Параллельных проверок
+MAX_CONCURRENT = 100     # Параллельных проверок (начальное значение)
+MIN_CONCURRENT = 10      # Нижняя граница адаптивного лимита
+MAX_CONCURRENT_LIMIT = 1000  # Верхняя граница адаптивного лимита
+ADAPT_WINDOW = 200       # Доступных прокси между пересчётами лимита
+ADAPT_SUCCESS_RATE = 0.7 # Доля доступных прокси без таймаута для роста лимита
+ADAPT_MAX_LATENCY_MS = 1000  # Средний пинг для роста лимита (мс)
 MAX_LATENCY_MS = 5000    # Максимальный пинг (мс)
 MIN_SPEED_KBPS = 10      # Минимальная скорость (KB/s)
+GEO_BATCH_SIZE = 100     # IP в одном запросе к ip-api.com/batch
+ENABLE_SPEED_TEST = True # Тест скорости (False - быстрый режим без скачивания)
+SPEED_TEST_MAX_BYTES = 65536  # Максимум байт для теста скорости
+LOG_FILE = None          # Файл для лога проверки (None - stdout)
+LOG_BATCH_SIZE = 64      # Строк лога до немедленной записи
+LOG_FLUSH_INTERVAL = 0.05  # Интервал записи лога (сек)
 
 # Тестовые URL
 TEST_FILE_URL = "https://www.google.com/favicon.ico"
@@ -35,8 +54,11 @@ CONNECTIVITY_URLS = [
     "https://cp.cloudflare.com/"
 ]
 
+# Ошибки сети при запросах через прокси
+NETWORK_ERRORS = (aiohttp.ClientError, asyncio.TimeoutError, OSError)
+
 
-@dataclass
+@dataclass(slots=True)
 class ProxyResult:
     """Результат проверки прокси"""
     proxy: str
@@ -54,6 +76,7 @@ class ProxyResult:
     country: str = ""
     country_code: str = ""
     isp: str = ""
+    flag: str = "🌍"
     error: str = ""
 
 
@@ -82,6 +105,17 @@ COUNTRY_PRIORITY = {
 }
 
 
+# [protocol://[user[:pass]@]]host[:port][/path|?query|#fragment]
+# или host:port[:user:pass] (хвост :user:pass - только без схемы)
+PROXY_RE = re.compile(
+    r'(?:(?P<protocol>\w+)://(?:(?P<user>[^:@/?#\s]+)(?::(?P<password>[^@/?#\s]*))?@)?)?'
+    r'(?:\[(?P<ipv6>[0-9a-fA-F:.]+)\]|(?P<host>[^:@/?#\[\]\s]+))'
+    r'(?::(?P<port>\d*))?'
+    r'(?:(?P<path>[/?#]\S*)|:(?P<user2>[^:\s]*)(?::(?P<password2>[^:\s]*)(?::\S*)?)?)?'
+    r'$'
+)
+
+
 def parse_proxy(line: str) -> Optional[Tuple[str, int, str, str, str]]:
     """
     Парсит прокси из строки
@@ -97,120 +131,246 @@ def parse_proxy(line: str) -> Optional[Tuple[str, int, str, str, str]]:
     if not line or line.startswith('#'):
         return None
     
-    protocol = 'http'
-    user = ''
-    password = ''
+    match = PROXY_RE.match(line)
+    if not match:
+        return None
     
-    # Проверяем URL формат
-    if '://' in line:
-        try:
-            parsed = urlparse(line)
-            protocol = parsed.scheme or 'http'
-            host = parsed.hostname
-            port = parsed.port or 8080
-            user = parsed.username or ''
-            password = parsed.password or ''
-            if host and port:
-                return (host, port, protocol, user, password)
-        except:
-            pass
+    protocol = match['protocol']
+    port = match['port']
+    host = match['ipv6'] or match['host']
+    if protocol is None:
+        # Без схемы: нужен порт, путь не допускается
+        if not port or match['path'] is not None:
+            return None
+        user = password = ''
+        # ip:port:extra - лишнее поле игнорируем, ip:port:user:pass - логин и пароль
+        if match['password2'] is not None:
+            user, password = match['user2'], match['password2']
+    else:
+        # В URL после порта - только путь: http://ip:port:user:pass
+        # и http://ip:abc не прокси
+        if match['user2'] is not None:
+            return None
+        # Как urlparse: схема и хост в URL формате без учёта регистра
+        protocol = protocol.lower()
+        host = host.lower()
+        user = match['user'] or ''
+        password = match['password'] or ''
     
-    # Формат ip:port или ip:port:user:pass
-    parts = line.split(':')
-    if len(parts) >= 2:
-        try:
-            host = parts[0]
-            port = int(parts[1])
-            if len(parts) >= 4:
-                user = parts[2]
-                password = parts[3]
-            return (host, port, protocol, user, password)
-        except:
-            pass
+    port = int(port) if port else 8080
+    if not 0 < port <= 65535:
+        return None
     
-    return None
+    return (
+        host,
+        port,
+        protocol or 'http',
+        user,
+        password
+    )
 
 
-def parse_proxy_list(content: str) -> list:
-    """Парсит список прокси из текста"""
+def parse_proxy_list(content: str, seen: Optional[set] = None) -> list:
+    """
+    Парсит список прокси из текста
+    seen - общее множество (host, port) для дедупликации между источниками
+    """
     proxies = []
-    seen = set()
+    if seen is None:
+        seen = set()
     
-    for line in content.split('\n'):
+    # BOM в начале скачанного файла не должен попасть в первый хост
+    for line in content.lstrip('\ufeff').split('\n'):
         parsed = parse_proxy(line)
         if parsed:
             host, port, protocol, user, password = parsed
-            key = f"{host}:{port}"
-            if key not in seen:
-                seen.add(key)
-                proxies.append({
-                    'host': host,
-                    'port': port,
-                    'protocol': protocol,
-                    'user': user,
-                    'password': password
-                })
+            key = (host, port)
+            if key in seen:
+                continue
+            
+            # Готовый URL для aiohttp - без повторного парсинга на каждый запрос
+            has_auth = bool(user and password)
+            try:
+                url = yarl.URL.build(
+                    scheme='http',
+                    user=user if has_auth else None,
+                    password=password if has_auth else None,
+                    host=host,
+                    port=port
+                )
+            except ValueError:
+                # Порт вне диапазона, недопустимый хост - пропускаем строку
+                continue
+            
+            seen.add(key)
+            proxies.append({
+                'host': host,
+                'port': port,
+                'protocol': protocol,
+                'user': user,
+                'password': password,
+                'url': url
+            })
     
     return proxies
 
 
-async def check_tcp(host: str, port: int) -> Tuple[bool, int]:
-    """TCP проверка + измерение latency"""
-    start = time.time()
+async def log_writer(log_queue: asyncio.Queue):
+    """
+    Пишет лог проверки пачками: раз в LOG_FLUSH_INTERVAL или по LOG_BATCH_SIZE строк
+    log_queue создаётся на каждый запуск main() - очередь привязана к своему event loop
+    """
+    out = open(LOG_FILE, 'a', encoding='utf-8') if LOG_FILE else sys.stdout
     try:
-        _, writer = await asyncio.wait_for(
-            asyncio.open_connection(host, port),
-            timeout=TIMEOUT_TCP
-        )
-        latency = int((time.time() - start) * 1000)
-        writer.close()
-        await writer.wait_closed()
-        return True, latency
-    except:
-        return False, 0
+        while True:
+            batch = [await log_queue.get()]
+            if log_queue.qsize() < LOG_BATCH_SIZE:
+                await asyncio.sleep(LOG_FLUSH_INTERVAL)
+            while not log_queue.empty():
+                batch.append(log_queue.get_nowait())
+            
+            # None - сигнал остановки
+            done = None in batch
+            lines = [line for line in batch if line is not None]
+            if lines:
+                out.write('\n'.join(lines) + '\n')
+                out.flush()
+            if done:
+                return
+    finally:
+        if out is not sys.stdout:
+            out.close()
 
 
-async def get_ip_info(session: aiohttp.ClientSession, ip: str) -> Tuple[str, str, str]:
-    """Получает информацию об IP"""
-    try:
-        async with session.get(
-            f"http://ip-api.com/json/{ip}?fields=country,countryCode,isp,org",
-            ssl=False,
-            timeout=aiohttp.ClientTimeout(total=10)
-        ) as resp:
-            if resp.status == 200:
-                data = await resp.json()
-                country = data.get('country', 'Unknown')
-                code = data.get('countryCode', 'XX')
-                isp = data.get('isp', '') or data.get('org', 'Unknown')
-                isp = isp.replace('LLC', '').replace('Ltd', '').replace('Limited', '')
-                isp = isp.replace('Corporation', '').replace('Inc.', '').strip()
-                if len(isp) > 25:
-                    isp = isp[:22] + "..."
-                return country, code, isp
-    except:
-        pass
-    return "Unknown", "XX", "Unknown"
+def parse_ip_info(data: dict) -> Tuple[str, str, str]:
+    """Разбирает ответ ip-api.com: (country, code, isp)"""
+    country = data.get('country', 'Unknown')
+    code = data.get('countryCode', 'XX')
+    isp = data.get('isp', '') or data.get('org', 'Unknown')
+    isp = isp.replace('LLC', '').replace('Ltd', '').replace('Limited', '')
+    isp = isp.replace('Corporation', '').replace('Inc.', '').strip()
+    if len(isp) > 25:
+        isp = isp[:22] + "..."
+    return country, code, isp
+
+
+async def get_ip_info_batch(http_client: httpx.AsyncClient, ips: list) -> dict:
+    """Получает информацию о списке IP через /batch (до 100 IP за запрос)"""
+    info = {}
+    for i in range(0, len(ips), GEO_BATCH_SIZE):
+        chunk = ips[i:i + GEO_BATCH_SIZE]
+        try:
+            resp = await http_client.post(
+                "http://ip-api.com/batch",
+                json=[{"query": ip, "fields": "query,status,country,countryCode,isp,org"}
+                      for ip in chunk]
+            )
+            if resp.status_code == 200:
+                for data in resp.json():
+                    if data.get('status') == 'success':
+                        info[data['query']] = parse_ip_info(data)
+        except (httpx.HTTPError, ValueError):
+            pass
+    return info
+
+
+class AdaptiveLimiter:
+    """
+    Ограничитель параллельных проверок с динамическим лимитом (AIMD)
+    Каждые ADAPT_WINDOW доступных прокси: мало таймаутов и низкий пинг -
+    лимит x1.25, иначе x0.8. Недоступные прокси в окно не входят: их
+    таймауты соединения говорят о списке, а не о перегрузке сети
+    """
+    
+    def __init__(self, limit: int, min_limit: int, max_limit: int, log_queue: asyncio.Queue):
+        self.limit = limit
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self._log = log_queue.put_nowait
+        self._active = 0
+        self._cond = asyncio.Condition()
+        self._checked = 0
+        self._ok = 0
+        self._latency_sum = 0
+    
+    async def __aenter__(self):
+        async with self._cond:
+            await self._cond.wait_for(lambda: self._active < self.limit)
+            self._active += 1
+    
+    async def __aexit__(self, *exc):
+        async with self._cond:
+            self._active -= 1
+            # Будим столько, сколько освободилось (с учётом роста лимита)
+            self._cond.notify(max(self.limit - self._active, 0))
+    
+    def record(self, ok: bool, latency_ms: int):
+        """
+        Учитывает проверку доступного прокси и пересчитывает лимит по окну
+        ok - без таймаута после соединения, latency_ms - пинг
+        """
+        self._checked += 1
+        if ok:
+            self._ok += 1
+        self._latency_sum += latency_ms
+        if self._checked < ADAPT_WINDOW:
+            return
+        
+        rate = self._ok / self._checked
+        mean_latency = self._latency_sum // self._checked
+        if rate > ADAPT_SUCCESS_RATE and mean_latency < ADAPT_MAX_LATENCY_MS:
+            self.limit = min(max(int(self.limit * 1.25), self.limit + 1), self.max_limit)
+        else:
+            self.limit = max(int(self.limit * 0.8), self.min_limit)
+        self._log(f"[лимит] {self.limit} параллельных "
+            f"(без таймаута {rate:.0%}, пинг {mean_latency}ms)")
+        
+        self._checked = 0
+        self._ok = 0
+        self._latency_sum = 0
+
+
+async def _on_connection_create_start(session, ctx, params):
+    ctx.start = time.perf_counter_ns()
+
+
+async def _on_connection_create_end(session, ctx, params):
+    timing = ctx.trace_request_ctx
+    if timing is not None:
+        timing['connect_ms'] = (time.perf_counter_ns() - ctx.start) // 1_000_000
+        timing['connected'].set()
+
+
+def connect_trace() -> aiohttp.TraceConfig:
+    """
+    Замер установки соединения с прокси (без ожидания ответа сайта)
+    Результат пишется в словарь, переданный как trace_request_ctx
+    """
+    trace = aiohttp.TraceConfig()
+    trace.on_connection_create_start.append(_on_connection_create_start)
+    trace.on_connection_create_end.append(_on_connection_create_end)
+    return trace
 
 
 async def check_proxy_full(
+    session: aiohttp.ClientSession,
     proxy_data: dict,
-    semaphore: asyncio.Semaphore,
+    limiter: AdaptiveLimiter,
+    log_queue: asyncio.Queue,
     counter: list,
     total: int,
     my_ip: str
 ) -> ProxyResult:
     """Полная проверка прокси"""
+    log = log_queue.put_nowait
     
-    async with semaphore:
+    async with limiter:
         counter[0] += 1
         num = counter[0]
         
         host = proxy_data['host']
         port = proxy_data['port']
         protocol = proxy_data['protocol']
-        user = proxy_data['user']
-        password = proxy_data['password']
         
         proxy_str = f"{host}:{port}"
         result = ProxyResult(
@@ -221,112 +381,179 @@ async def check_proxy_full(
             working=False
         )
         
-        print(f"[{num}/{total}] {proxy_str}", flush=True)
+        log(f"[{num}/{total}] {proxy_str}")
         
-        # === ЭТАП 1: TCP Ping ===
-        tcp_ok, latency = await check_tcp(host, port)
-        result.tcp_ok = tcp_ok
-        result.latency_ms = latency
+        # === ЭТАП 1: HTTP/HTTPS проверка ===
+        # Отдельного TCP пинга нет: latency - время установки соединения
+        # с прокси в этих же запросах (connect_trace), таймаут TCP
+        # соединения задан в сессии (sock_connect)
+        proxy_url = proxy_data['url']
+        connected = asyncio.Event()
+        http_timing = {'connect_ms': None, 'connected': connected}
+        https_timing = {'connect_ms': None, 'connected': connected}
         
-        if not tcp_ok:
-            print(f"  ✗ TCP: недоступен", flush=True)
-            return result
-        
-        if latency > MAX_LATENCY_MS:
-            print(f"  ✗ TCP: пинг слишком высокий ({latency}ms)", flush=True)
-            return result
+        async def _check_http() -> Tuple[bool, bool, str]:
+            """HTTP запрос через прокси: (connected, ok, ошибка)"""
+            try:
+                async with session.get(
+                    "http://httpbin.org/ip",
+                    proxy=proxy_url,
+                    ssl=False,
+                    trace_request_ctx=http_timing
+                ) as resp:
+                    return True, resp.status == 200, ""
+            except asyncio.TimeoutError:
+                return http_timing['connect_ms'] is not None, False, "timeout"
+            except aiohttp.ClientConnectorError as e:
+                return False, False, type(e).__name__
+            except NETWORK_ERRORS as e:
+                # Соединение с прокси было, но запрос не прошёл
+                return True, False, type(e).__name__
         
-        print(f"  ✓ TCP: {latency}ms", flush=True)
+        async def _check_https() -> Tuple[bool, bool, str, str]:
+            """HTTPS запрос через прокси: (connected, ok, exit_ip, ошибка)"""
+            try:
+                async with session.get(
+                    "https://api.ipify.org?format=json",
+                    proxy=proxy_url,
+                    trace_request_ctx=https_timing
+                ) as resp:
+                    if resp.status == 200:
+                        data = await resp.json()
+                        return True, True, data.get('ip', ''), ""
+                    return True, False, "", ""
+            except asyncio.TimeoutError:
+                return https_timing['connect_ms'] is not None, False, "", "timeout"
+            except aiohttp.ClientConnectorError as e:
+                return False, False, "", type(e).__name__
+            except (*NETWORK_ERRORS, ValueError) as e:
+                return True, False, "", type(e).__name__
         
-        # === ЭТАП 2: HTTP/HTTPS проверка ===
-        if user and password:
-            proxy_url = f"http://{user}:{password}@{host}:{port}"
-        else:
-            proxy_url = f"http://{host}:{port}"
+        async def _check_speed() -> float:
+            """Скачивание тестового файла через прокси: KB/s"""
+            # Недоступный прокси не получает третью попытку соединения
+            await connected.wait()
+            try:
+                start = time.perf_counter_ns()
+                async with session.get(
+                    TEST_FILE_URL,
+                    proxy=proxy_url
+                ) as resp:
+                    if resp.status == 200:
+                        # Считаем байты по мере чтения, не буферизуя тело
+                        total = 0
+                        async for chunk in resp.content.iter_chunked(8192):
+                            total += len(chunk)
+                            if total >= SPEED_TEST_MAX_BYTES:
+                                break
+                        elapsed_ns = time.perf_counter_ns() - start
+                        if total > 0 and elapsed_ns > 0:
+                            return (total / 1024) / (elapsed_ns / 1_000_000_000)
+            except NETWORK_ERRORS:
+                pass
+            return 0
         
-        timeout = aiohttp.ClientTimeout(total=TIMEOUT_PROXY, connect=10)
+        # Тест скорости ждёт первого соединения с прокси и отменяется,
+        # если прокси не прошёл ни одну из проверок
+        speed_task = asyncio.create_task(_check_speed()) if ENABLE_SPEED_TEST else None
         
         try:
-            async with aiohttp.ClientSession(timeout=timeout) as session:
-                # Проверка HTTP
-                try:
-                    async with session.get(
-                        "http://httpbin.org/ip",
-                        proxy=proxy_url,
-                        ssl=False
-                    ) as resp:
-                        if resp.status == 200:
-                            result.http_ok = True
-                            print(f"  ✓ HTTP: работает", flush=True)
-                except Exception as e:
-                    print(f"  ✗ HTTP: {type(e).__name__}", flush=True)
-                
-                # Проверка HTTPS
-                try:
-                    async with session.get(
-                        "https://api.ipify.org?format=json",
-                        proxy=proxy_url
-                    ) as resp:
-                        if resp.status == 200:
-                            result.https_ok = True
-                            data = await resp.json()
-                            result.exit_ip = data.get('ip', '')
-                            print(f"  ✓ HTTPS: работает", flush=True)
-                except Exception as e:
-                    print(f"  ✗ HTTPS: {type(e).__name__}", flush=True)
-                
-                if not result.http_ok and not result.https_ok:
-                    result.error = "no_connectivity"
-                    return result
-                
-                # === ЭТАП 3: Проверка анонимности ===
-                if result.exit_ip and result.exit_ip != my_ip:
-                    result.anonymous = True
-                    # Получаем гео-данные
-                    country, code, isp = await get_ip_info(session, result.exit_ip)
-                    result.country = country
-                    result.country_code = code
-                    result.isp = isp
-                    flag = COUNTRY_FLAGS.get(code, "🌍")
-                    print(f"  ✓ IP: {result.exit_ip} | {flag} {country}", flush=True)
-                
-                # === ЭТАП 4: Тест скорости ===
-                try:
-                    start = time.time()
-                    async with session.get(
-                        TEST_FILE_URL,
-                        proxy=proxy_url
-                    ) as resp:
-                        if resp.status == 200:
-                            data = await resp.read()
-                            elapsed = time.time() - start
-                            if len(data) > 0 and elapsed > 0:
-                                result.speed_kbps = (len(data) / 1024) / elapsed
-                                print(f"  ✓ Speed: {result.speed_kbps:.1f} KB/s", flush=True)
-                except:
-                    pass
-                
-                # === ИТОГ ===
-                result.working = (result.http_ok or result.https_ok)
-                
-                if result.working:
-                    print(f"  ★ РАБОЧИЙ!", flush=True)
-                
+            # HTTP и HTTPS независимы - запускаем параллельно
+            http_res, https_res = await asyncio.gather(
+                _check_http(), _check_https(),
+                return_exceptions=True
+            )
+            
+            if isinstance(http_res, BaseException):
+                http_res = (False, False, type(http_res).__name__)
+            if isinstance(https_res, BaseException):
+                https_res = (False, False, "", type(https_res).__name__)
+            
+            http_connected, result.http_ok, http_err = http_res
+            https_connected, result.https_ok, result.exit_ip, https_err = https_res
+            result.tcp_ok = http_connected or https_connected
+            # HTTPS соединение включает CONNECT и TLS - только запасной вариант
+            if http_timing['connect_ms'] is not None:
+                result.latency_ms = http_timing['connect_ms']
+            elif https_timing['connect_ms'] is not None:
+                result.latency_ms = https_timing['connect_ms']
+            if not result.tcp_ok:
+                log(f"  ✗ TCP: недоступен")
+                if speed_task:
+                    speed_task.cancel()
                 return result
-                
+            
+            # Перегрузка сети - таймаут уже после соединения с прокси
+            timed_out = (
+                (http_connected and http_err == "timeout")
+                or (https_connected and https_err == "timeout")
+            )
+            limiter.record(not timed_out, result.latency_ms)
+            
+            if result.latency_ms > MAX_LATENCY_MS:
+                log(f"  ✗ Ping: слишком высокий ({result.latency_ms}ms)")
+                if speed_task:
+                    speed_task.cancel()
+                return result
+            
+            log(f"  ✓ Ping: {result.latency_ms}ms")
+            
+            if result.http_ok:
+                log(f"  ✓ HTTP: работает")
+            elif http_err:
+                log(f"  ✗ HTTP: {http_err}")
+            
+            if result.https_ok:
+                log(f"  ✓ HTTPS: работает")
+            elif https_err:
+                log(f"  ✗ HTTPS: {https_err}")
+            
+            if not result.http_ok and not result.https_ok:
+                result.error = "no_connectivity"
+                if speed_task:
+                    speed_task.cancel()
+                return result
+            
+            # === ЭТАП 2: Проверка анонимности ===
+            if result.exit_ip and result.exit_ip != my_ip:
+                result.anonymous = True
+                log(f"  ✓ IP: {result.exit_ip}")
+            
+            # === ЭТАП 3: Тест скорости ===
+            # Прокси ответил, даже если соединение не попало в замер
+            connected.set()
+            speed = await speed_task if speed_task else 0
+            if speed > 0:
+                result.speed_kbps = speed
+                log(f"  ✓ Speed: {result.speed_kbps:.1f} KB/s")
+            
+            # === ИТОГ ===
+            result.working = (result.http_ok or result.https_ok)
+            
+            if result.working:
+                log(f"  ★ РАБОЧИЙ!")
+            
+            return result
+            
+        except asyncio.CancelledError:
+            # Остановка не должна теряться в обработке ошибок
+            if speed_task:
+                speed_task.cancel()
+            raise
         except Exception as e:
-            print(f"  ✗ Error: {e}", flush=True)
+            if speed_task:
+                speed_task.cancel()
+            log(f"  ✗ Error: {e}")
             result.error = str(e)
             return result
 
 
-async def get_my_ip() -> str:
+async def get_my_ip(http_client: httpx.AsyncClient) -> str:
     """Получает текущий IP"""
     try:
-        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=10)) as session:
-            async with session.get("https://api.ipify.org") as resp:
-                return (await resp.text()).strip()
-    except:
+        resp = await http_client.get("https://api.ipify.org")
+        return resp.text.strip()
+    except httpx.HTTPError:
         return ""
 
 
@@ -343,14 +570,20 @@ async def fetch_proxy_list(url: str) -> str:
     return ""
 
 
-async def main():
+def write_file(path: str, data: bytes):
+    """Записывает готовые байты в файл"""
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+async def main(http_client: httpx.AsyncClient):
     print("=" * 60)
     print("HTTP/HTTPS Proxy Checker Pro")
     print("=" * 60)
     
     # Получаем свой IP
     print("\nПолучаю текущий IP...")
-    my_ip = await get_my_ip()
+    my_ip = await get_my_ip(http_client)
     if my_ip:
         print(f"Мой IP: {my_ip}")
     else:
@@ -371,25 +604,18 @@ async def main():
         print("No proxy sources found!")
         return
     
-    all_proxies = []
+    # Дубликаты отсеиваются при парсинге через общий seen
+    unique_proxies = []
+    seen = set()
     print(f"\nЗагружаю {len(urls)} источников...")
     
     for url in urls:
         print(f"  {url[:60]}...")
         content = await fetch_proxy_list(url)
         if content:
-            proxies = parse_proxy_list(content)
-            print(f"    Найдено {len(proxies)} прокси")
-            all_proxies.extend(proxies)
-    
-    # Убираем дубликаты
-    seen = set()
-    unique_proxies = []
-    for p in all_proxies:
-        key = f"{p['host']}:{p['port']}"
-        if key not in seen:
-            seen.add(key)
-            unique_proxies.append(p)
+            proxies = parse_proxy_list(content, seen)
+            print(f"    Найдено {len(proxies)} новых прокси")
+            unique_proxies.extend(proxies)
     
     print(f"\nВсего уникальных прокси: {len(unique_proxies)}")
     
@@ -402,19 +628,48 @@ async def main():
     print("НАЧИНАЮ ПРОВЕРКУ")
     print(f"{'=' * 60}")
     
-    semaphore = asyncio.Semaphore(MAX_CONCURRENT)
+    # Очередь лога проверки: строки пишутся пачками одной задачей
+    log_queue = asyncio.Queue()
+    limiter = AdaptiveLimiter(MAX_CONCURRENT, MIN_CONCURRENT, MAX_CONCURRENT_LIMIT, log_queue)
     counter = [0]
     total = len(unique_proxies)
     
-    tasks = [check_proxy_full(p, semaphore, counter, total, my_ip) for p in unique_proxies]
-    results = await asyncio.gather(*tasks)
+    # Одна сессия на все проверки: общий пул соединений и DNS кэш.
+    # Параллельность ограничивает limiter, у пула своего лимита нет
+    connector = aiohttp.TCPConnector(
+        limit=0,
+        ttl_dns_cache=300,
+        use_dns_cache=True
+    )
+    timeout = aiohttp.ClientTimeout(total=TIMEOUT_PROXY, connect=10, sock_connect=TIMEOUT_TCP)
+    
+    writer = asyncio.create_task(log_writer(log_queue))
+    async with aiohttp.ClientSession(
+        connector=connector,
+        timeout=timeout,
+        trace_configs=[connect_trace()]
+    ) as session:
+        tasks = [check_proxy_full(session, p, limiter, log_queue, counter, total, my_ip)
+                 for p in unique_proxies]
+        results = await asyncio.gather(*tasks)
+    log_queue.put_nowait(None)
+    await writer
+    
+    # Гео-данные для анонимных прокси - пакетно, после всех проверок
+    exit_ips = list({r.exit_ip for r in results if r.working and r.anonymous})
+    if exit_ips:
+        print(f"\nПолучаю гео-данные для {len(exit_ips)} IP...")
+        ip_info = await get_ip_info_batch(http_client, exit_ips)
+        for r in results:
+            if r.working and r.anonymous:
+                r.country, r.country_code, r.isp = ip_info.get(
+                    r.exit_ip, ("Unknown", "XX", "Unknown")
+                )
+                r.flag = COUNTRY_FLAGS.get(r.country_code, "🌍")
     
     # Фильтруем рабочие
     working = [r for r in results if r.working]
     
-    # Сортируем по качеству
-    working.sort(key=lambda r: (r.latency_ms, -r.speed_kbps))
-    
     # Статистика
     print(f"\n{'=' * 60}")
     print("РЕЗУЛЬТАТЫ")
@@ -427,41 +682,48 @@ async def main():
     print(f"\n★ РАБОЧИХ ПРОКСИ: {len(working)}")
     
     if working:
-        # Сортируем по стране и пингу
+        # Сортируем по стране, пингу и скорости - одним проходом
         def sort_key(r):
             priority = COUNTRY_PRIORITY.get(r.country_code, 99)
-            return (priority, r.latency_ms)
+            return (priority, r.latency_ms, -r.speed_kbps)
         
         working.sort(key=sort_key)
         
         # Топ-5
         print(f"\nТоп-5 по качеству:")
         for i, r in enumerate(working[:5], 1):
-            flag = COUNTRY_FLAGS.get(r.country_code, "🌍")
             proto = "HTTPS" if r.https_ok else "HTTP"
             anon = "🔒" if r.anonymous else "👁"
-            print(f"  {i}. {flag} {r.country} | {r.latency_ms}ms | {proto} | {anon}")
+            print(f"  {i}. {r.flag} {r.country} | {r.latency_ms}ms | {proto} | {anon}")
         
         # === Сохраняем результаты ===
         
+        # Содержимое всех файлов готовим заранее (путь -> bytes),
+        # затем пишем параллельно
+        files = {}
+        
         # 1. Простой список ip:port
-        with open('proxies.txt', 'w') as f:
-            f.write('\n'.join([f"{r.host}:{r.port}" for r in working]))
+        files['proxies.txt'] = '\n'.join([f"{r.host}:{r.port}" for r in working]).encode()
         
         # 2. HTTP формат
         http_proxies = [r for r in working if r.http_ok]
-        with open('proxies_http.txt', 'w') as f:
-            f.write('\n'.join([f"http://{r.host}:{r.port}" for r in http_proxies]))
+        files['proxies_http.txt'] = '\n'.join(
+            [f"http://{r.host}:{r.port}" for r in http_proxies]).encode()
         
         # 3. HTTPS формат
         https_proxies = [r for r in working if r.https_ok]
-        with open('proxies_https.txt', 'w') as f:
-            f.write('\n'.join([f"http://{r.host}:{r.port}" for r in https_proxies]))
+        files['proxies_https.txt'] = '\n'.join(
+            [f"http://{r.host}:{r.port}" for r in https_proxies]).encode()
         
         # 4. Только анонимные
         anon_proxies = [r for r in working if r.anonymous]
-        with open('proxies_anonymous.txt', 'w') as f:
-            f.write('\n'.join([f"{r.host}:{r.port}" for r in anon_proxies]))
+        files['proxies_anonymous.txt'] = '\n'.join(
+            [f"{r.host}:{r.port}" for r in anon_proxies]).encode()
+        
+        # Группируем по странам одним проходом
+        country_proxies = defaultdict(list)
+        for r in working:
+            country_proxies[r.country_code or "XX"].append(r)
         
         # 5. JSON отчёт
         report = {
@@ -471,20 +733,18 @@ async def main():
             "https_count": len(https_proxies),
             "anonymous_count": len(anon_proxies),
             "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
-            "countries": {},
+            "countries": {
+                code: {
+                    "name": proxies[0].country,
+                    "flag": proxies[0].flag,
+                    "count": len(proxies)
+                }
+                for code, proxies in country_proxies.items()
+            },
             "proxies": []
         }
         
         for r in working:
-            code = r.country_code or "XX"
-            if code not in report["countries"]:
-                report["countries"][code] = {
-                    "name": r.country,
-                    "flag": COUNTRY_FLAGS.get(code, "🌍"),
-                    "count": 0
-                }
-            report["countries"][code]["count"] += 1
-            
             report["proxies"].append({
                 "host": r.host,
                 "port": r.port,
@@ -493,35 +753,29 @@ async def main():
                 "anonymous": r.anonymous,
                 "country": r.country,
                 "country_code": r.country_code,
-                "flag": COUNTRY_FLAGS.get(r.country_code, "🌍"),
+                "flag": r.flag,
                 "isp": r.isp,
                 "latency_ms": r.latency_ms,
                 "speed_kbps": round(r.speed_kbps, 1),
                 "exit_ip": r.exit_ip
             })
         
-        with open('proxy_report.json', 'w', encoding='utf-8') as f:
-            json.dump(report, f, indent=2, ensure_ascii=False)
+        files['proxy_report.json'] = orjson.dumps(report, option=orjson.OPT_INDENT_2)
         
         # 6. Папка по странам
         countries_dir = 'countries'
         if not os.path.exists(countries_dir):
             os.makedirs(countries_dir)
         
-        country_proxies = {}
-        for r in working:
-            code = r.country_code or "XX"
-            if code not in country_proxies:
-                country_proxies[code] = []
-            country_proxies[code].append(r)
-        
         for code, proxies in country_proxies.items():
             country_name = proxies[0].country or "Unknown"
             filename = f"{country_name.lower().replace(' ', '_')}.txt"
             filepath = os.path.join(countries_dir, filename)
-            
-            with open(filepath, 'w') as f:
-                f.write('\n'.join([f"{r.host}:{r.port}" for r in proxies]))
+            files[filepath] = '\n'.join([f"{r.host}:{r.port}" for r in proxies]).encode()
+        
+        await asyncio.gather(*[
+            asyncio.to_thread(write_file, path, data) for path, data in files.items()
+        ])
         
         print(f"\n{'=' * 60}")
         print("СОХРАНЕНО:")
@@ -541,5 +795,21 @@ async def main():
                 file.write('')
 
 
+async def run():
+    # Клиент для прямых запросов (свой IP, гео-данные) - HTTP/2 + keep-alive.
+    # Создаётся на каждый запуск: пул соединений привязан к event loop
+    http_client = httpx.AsyncClient(
+        http2=True,
+        limits=httpx.Limits(max_connections=200, max_keepalive_connections=50),
+        timeout=10.0
+    )
+    try:
+        await main(http_client)
+    finally:
+        await http_client.aclose()
+
+
 if __name__ == '__main__':
-    asyncio.run(main())
+    if uvloop is not None:
+        uvloop.install()
+    asyncio.run(run())